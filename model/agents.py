@@ -3,91 +3,237 @@ import pandas as pd
 
 from gridworld import Task
 from cython_library import RewardHypothesis, MappingHypothesis, TransitionHypothesis
-from cython_library import policy_iteration, value_iteration
+from cython_library import update_reward_batch, update_mapping_batch
+from cython_library import policy_iteration, value_iteration, get_log_posterior_batch
 
 
 from sklearn.metrics import euclidean_distances
 from scipy.misc import logsumexp
 
+# numba is optional; when it is present the small numeric kernels are jitted,
+# otherwise the vectorized numpy fallbacks below are used
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 """ these agents differ from the generative agents I typically use in that I need to pass a transition
 function (and possibly a reward function) to the agent for each trial. """
 
+# use the Generator API when available (it avoids the global-lock legacy RNG);
+# fall back to the legacy module functions on older numpy builds
+if hasattr(np.random, 'default_rng'):
+    _rng = np.random.default_rng()
+else:
+    _rng = np.random
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _q_primitive_kernel(q_abstract, mapping):
+        n_primitive = mapping.shape[0]
+        n_abstract = q_abstract.shape[0]
+        q_primitive = np.zeros(n_primitive)
+        for a in range(n_primitive):
+            acc = 0.0
+            for aa in range(n_abstract):
+                acc += mapping[a, aa] * q_abstract[aa]
+            q_primitive[a] = acc
+        return q_primitive
+else:
+    def _q_primitive_kernel(q_abstract, mapping):
+        return mapping[:, :len(q_abstract)].dot(q_abstract)
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _normalize_log_posterior(log_posterior):
+        # normalize in log space (subtract the log-sum-exp), fused in one pass
+        n = log_posterior.shape[0]
+        max_val = log_posterior[0]
+        for ii in range(1, n):
+            if log_posterior[ii] > max_val:
+                max_val = log_posterior[ii]
+
+        total = 0.0
+        for ii in range(n):
+            total += np.exp(log_posterior[ii] - max_val)
+
+        shift = max_val + np.log(total)
+        for ii in range(n):
+            log_posterior[ii] -= shift
+
+        return log_posterior
+else:
+    def _normalize_log_posterior(log_posterior):
+        np.subtract(log_posterior, log_posterior.max(), out=log_posterior)
+        log_posterior -= np.log(np.exp(log_posterior).sum())
+        return log_posterior
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _sample_abstract_action(pmf_stack, log_belief, beta, u):
+        # mix the per-hypothesis pmfs with the posterior, softmax the result
+        # and draw from it, all in one compiled pass
+        n_h = pmf_stack.shape[0]
+        n_aa = pmf_stack.shape[1]
+
+        q_values = np.zeros(n_aa)
+        for ii in range(n_h):
+            w = np.exp(log_belief[ii]) * beta
+            for aa in range(n_aa):
+                q_values[aa] += w * pmf_stack[ii, aa]
+
+        max_val = q_values[0]
+        for aa in range(1, n_aa):
+            if q_values[aa] > max_val:
+                max_val = q_values[aa]
+
+        total = 0.0
+        for aa in range(n_aa):
+            q_values[aa] = np.exp(q_values[aa] - max_val)
+            total += q_values[aa]
+
+        inv_total = 1.0 / total
+        for aa in range(n_aa):
+            q_values[aa] *= inv_total
+
+        acc = 0.0
+        for aa in range(n_aa):
+            acc += q_values[aa]
+            if u < acc:
+                return aa
+        return n_aa - 1
+else:
+    def _sample_abstract_action(pmf_stack, log_belief, beta, u):
+        weights = np.exp(log_belief)
+        weights *= beta
+        q_values = weights.dot(pmf_stack)
+
+        # stable softmax; the max shift stops large inverse temperatures from
+        # overflowing exp
+        q_values -= q_values.max()
+        np.exp(q_values, out=q_values)
+        q_values *= 1.0 / q_values.sum()
+
+        # cumulate in place and binary-search the cmf directly
+        np.cumsum(q_values, out=q_values)
+        return int(np.searchsorted(q_values, u, side='right'))
+
 
 def make_q_primitive(q_abstract, mapping):
-    q_primitive = np.zeros(8)
-    n, m = np.shape(mapping)
-    for aa in range(m):
-        for a in range(n):
-            q_primitive[a] += q_abstract[aa] * mapping[a, aa]
-    return q_primitive
+    # single matrix-vector product; slice off the trailing dummy abstract action
+    # if the mapping carries one
+    mapping = np.asarray(mapping, dtype=np.float64)
+    q_abstract = np.asarray(q_abstract, dtype=np.float64)
+    return _q_primitive_kernel(q_abstract, mapping)
+
+
+# assignments are stored as compact int8 arrays indexed by context id, with -1
+# marking a context that has not been assigned to a cluster yet
+
+
+def _assignment_to_array(assignment, n_ctx):
+    """ convert a {context: cluster} dictionary to the array representation """
+    # contexts are not first-encountered in numeric order (tasks shuffle the
+    # context sequence), so an assigned id can fall past the requested
+    # length; size by whichever is larger
+    if len(assignment) > 0:
+        n_ctx = max(n_ctx, max(assignment.keys()) + 1)
+    arr = np.full(n_ctx, -1, dtype=np.int8)
+    for c, k in assignment.iteritems():
+        arr[c] = k
+    return arr
+
+
+# the full enumeration grows with the Bell number of the context count, so cache it
+# across agent constructions
+_assignment_cache = dict()
 
 
 def enumerate_assignments(max_context_number):
     """
      enumerate all possible assignments of contexts to clusters for a fixed number of contexts. Has the
      hard assumption that the first context belongs to cluster #1, to remove redundant assignments that
-     differ in labeling.
+     differ in labeling. Results are memoized across calls, as the same context count
+     recurs across simulation runs.
 
     :param max_context_number: int
-    :return: list of lists, each a function that takes in a context id number and returns a cluster id number
+    :return: list of int8 arrays, each indexed by context id number and holding a cluster id number
     """
-    cluster_assignments = [{}]  # context 0 is always in cluster 1
+    if max_context_number not in _assignment_cache:
+        cluster_assignments = list()  # context 0 is always in cluster 1
 
-    for contextNumber in range(0, max_context_number):
-        cluster_assignments = augment_assignments(cluster_assignments, contextNumber)
+        for contextNumber in range(0, max_context_number):
+            cluster_assignments = augment_assignments(cluster_assignments, contextNumber)
 
-    return cluster_assignments
+        _assignment_cache[max_context_number] = cluster_assignments
+
+    # hand back copies so callers can't mutate the cached assignments
+    return [assignment.copy() for assignment in _assignment_cache[max_context_number]]
 
 
 def augment_assignments(cluster_assignments, new_context):
-    if (len(cluster_assignments) == 0) | (len(cluster_assignments[0]) == 0):
-        _cluster_assignments = list()
-        _cluster_assignments.append({new_context: 0})
-    else:
-        _cluster_assignments = list()
-        for assignment in cluster_assignments:
-            new_list = list()
-            for k in range(0, max(assignment.values()) + 2):
-                _assignment_copy = assignment.copy()
-                _assignment_copy[new_context] = k
-                new_list.append(_assignment_copy)
-            _cluster_assignments += new_list
+    if (len(cluster_assignments) == 0) or (np.max(cluster_assignments[0]) < 0):
+        assignment = np.full(new_context + 1, -1, dtype=np.int8)
+        assignment[new_context] = 0
+        return [assignment]
+
+    _cluster_assignments = list()
+    for assignment in cluster_assignments:
+        # grow the array if the new context id falls past its end
+        if len(assignment) <= new_context:
+            base = np.full(new_context + 1, -1, dtype=np.int8)
+            base[:len(assignment)] = assignment
+        else:
+            base = assignment
+
+        for k in range(0, int(assignment.max()) + 2):
+            new_assignment = base.copy()
+            new_assignment[new_context] = k
+            _cluster_assignments.append(new_assignment)
 
     return _cluster_assignments
 
 
 def softmax_to_pdf(q_values, inverse_temperature):
     pdf = np.exp(np.array(q_values) * float(inverse_temperature))
-    pdf = pdf / np.sum(pdf)
+    pdf *= 1.0 / pdf.sum()
     return pdf
 
 
 def sample_cmf(cmf):
-    return int(np.sum(np.random.rand() > cmf))
+    # binary search on the cumulative function with a single uniform draw
+    return int(np.searchsorted(cmf, _rng.random(), side='right'))
 
 
-def displacement_to_abstract_action(dx, dy):
-    if (not dx == 0) & (not dy == 0):
-        return -1
+def _softmax_sample(q_values, inverse_temperature):
+    # fused softmax + sample; subtracting the max keeps the exponentials
+    # stable, and sampling on the unnormalized cumsum skips the divide
+    x = np.asarray(q_values, dtype=np.float64) * inverse_temperature
+    x = x - x.max()
+    np.exp(x, out=x)
+    cmf = np.cumsum(x)
+    return int(np.searchsorted(cmf, _rng.random() * cmf[-1], side='right'))
 
-    if dx == 1:
-        return 0
-    elif dx == -1:
-        return 1
-    elif dy == 1:
-        return 2
-    elif dy == -1:
-        return 3
-    else:
-        return -1
+
+# lookup table over the four unit displacements; anything else (diagonal or
+# no movement) falls through to the "wait" action
+_DISP_LUT = {(1, 0): 0, (-1, 0): 1, (0, 1): 2, (0, -1): 3}
+
+
+def displacement_to_abstract_action(dx, dy):
+    return _DISP_LUT.get((dx, dy), -1)
 
 
 def kl_divergence(q, p):
-    d = 0
-    for q_ii, p_ii in zip(q, p):
-        if p_ii > 0:
-            d += p_ii * np.log2(p_ii/q_ii)
-    return d
+    q = np.asarray(q, dtype=np.float64)
+    p = np.asarray(p, dtype=np.float64)
+
+    # single vectorized log2 over the supported entries
+    m = (p > 0) & (q > 0)
+    return float(np.sum(p[m] * np.log2(p[m] / q[m])))
 
 
 def thompson_sample(pmf):
@@ -102,11 +248,20 @@ def thompson_sample(pmf):
 
 class MultiStepAgent(object):
 
-    def __init__(self, task):
+    def __init__(self, task, seed=None):
         self.task = task
         assert type(self.task) is Task
         self.current_trial = 0
 
+        # per-agent generator, so parallel simulations don't contend for (or
+        # perturb) the global numpy random state
+        if hasattr(np.random, 'default_rng'):
+            self._rng = np.random.default_rng(seed)
+            self._randint = self._rng.integers
+        else:
+            self._rng = np.random.RandomState(seed)
+            self._randint = self._rng.randint
+
     def get_action_pmf(self, state):
         return np.ones(self.task.n_primitive_actions, dtype=float) / self.task.n_primitive_actions
 
@@ -136,7 +291,7 @@ class MultiStepAgent(object):
 
     def get_rewards_kl(self, state):
         f_rew = self.get_reward_function(state)
-        f_rew /= np.sum(f_rew)
+        f_rew *= 1.0 / f_rew.sum()
         return kl_divergence(f_rew, self.task.get_reward_function())
 
     def get_transition_error(self, state):
@@ -232,19 +387,19 @@ class MultiStepAgent(object):
             self.update(experience_tuple)
 
             trial_dict = {
-                'Start Location': [(x, y)],
-                'End Location': [(xp, yp)],
-                'context': [c],
-                'key-press': [action],
-                'action': [inverse_abstract_action_key[aa]],  # the cardinal movement, in words
-                'Reward Collected': [r],
+                'Start Location': (x, y),
+                'End Location': (xp, yp),
+                'context': c,
+                'key-press': action,
+                'action': inverse_abstract_action_key[aa],  # the cardinal movement, in words
+                'Reward Collected': r,
                 'n actions taken': step_counter[t],
-                'Trial Number': [t],
+                'Trial Number': t,
                 'In goal': not (self.task.current_trial_number == t),
                 'Times Seen Context': times_seen_ctx[c],
-                'action_map': [action_map],
-                'goal location': [goal_location],
-                'walls': [walls],
+                'action_map': action_map,
+                'goal location': goal_location,
+                'walls': walls,
                 'Steps in Context': steps_in_ctx[c]
             }
 
@@ -254,18 +409,20 @@ class MultiStepAgent(object):
 
             if evaluate_map_estimate:
                 trial_dict['KL MAP Mapping'] = kl_map
-                trial_dict['MAP Q-function'] = [map_rewards]
-                trial_dict['Full Q-Function'] = [full_rewards]
+                trial_dict['MAP Q-function'] = map_rewards
+                trial_dict['Full Q-Function'] = full_rewards
                 trial_dict['KL MAP Rewards'] = kl_rew
 
             if self.is_meta():
                 trial_dict['Joint Agent Prob'] = self.get_joint_probability()
 
-            results.append(pd.DataFrame(trial_dict, index=[ii]))
+            # accumulate plain dicts and build the frame once at the end --
+            # per-row DataFrames + concat are quadratic in the number of steps
+            results.append(trial_dict)
 
             ii += 1
 
-        return pd.concat(results)
+        return pd.DataFrame(results)
 
 
 class FullInformationAgent(MultiStepAgent):
@@ -282,19 +439,33 @@ class FullInformationAgent(MultiStepAgent):
         self.current_trial = 0
         self.n_abstract_actions = self.task.n_abstract_actions
 
+        # cache the solved policy; the trial's reward function depends only on
+        # the successor state, so one policy serves every step of the trial
+        self._cached_policy = None
+        self._cached_policy_trial = None
+
+        # inverted action dictionaries, rebuilt once per trial
+        self._inverse_aa_key = None
+        self._inverse_action_map = None
+        self._inverse_keys_trial = None
+
     def select_abstract_action(self, state):
         (x, y), c = state
 
         # what is current state?
         s = self.task.state_location_key[(x, y)]
 
-        pi = policy_iteration(self.task.current_trial.transition_function,
-                              self.task.current_trial.reward_function[s, :],
-                              gamma=self.gamma,
-                              stop_criterion=self.iteration_criterion)
+        t = self.task.current_trial_number
+        if self._cached_policy is None or self._cached_policy_trial != t:
+            self._cached_policy = policy_iteration(
+                self.task.current_trial.transition_function,
+                self.task.current_trial.reward_function[s, :],
+                gamma=self.gamma,
+                stop_criterion=self.iteration_criterion)
+            self._cached_policy_trial = t
 
         # use the policy to choose the correct action for the current state
-        abstract_action = pi[s]
+        abstract_action = self._cached_policy[s]
 
         return abstract_action
 
@@ -303,12 +474,18 @@ class FullInformationAgent(MultiStepAgent):
 
         abstract_action = self.select_abstract_action(state)
 
-        # use the actual action_mapping to get the correct primitive action key
-        inverse_abstract_action_key = {aa: move for move, aa in self.task.current_trial.abstract_action_key.iteritems()}
-        inverse_action_map = {move: key_press for key_press, move in self.task.current_trial.action_map.iteritems()}
-
-        move = inverse_abstract_action_key[abstract_action]
-        key_press = inverse_action_map[move]
+        # use the actual action_mapping to get the correct primitive action key;
+        # the mappings are fixed within a trial, so only invert them once
+        t = self.task.current_trial_number
+        if self._inverse_keys_trial != t or self._inverse_aa_key is None:
+            self._inverse_aa_key = \
+                {aa: move for move, aa in self.task.current_trial.abstract_action_key.iteritems()}
+            self._inverse_action_map = \
+                {move: key_press for key_press, move in self.task.current_trial.action_map.iteritems()}
+            self._inverse_keys_trial = t
+
+        move = self._inverse_aa_key[abstract_action]
+        key_press = self._inverse_action_map[move]
         return key_press
         # a = key_press_to_primitive[key_press]
 
@@ -341,6 +518,15 @@ class ModelBasedAgent(FullInformationAgent):
         self.reward_received = np.ones((self.task.n_ctx, self.task.n_states)) * 0.001
         self.reward_function = np.ones((self.task.n_ctx, self.task.n_states)) * (0.001/0.0101)
 
+        # policy cache, keyed on (trial, context, reward version) so it is
+        # invalidated whenever the learned reward function changes
+        self._cached_policy = None
+        self._cached_policy_key = None
+        self._reward_version = 0
+
+        # reusable buffer for the primitive-action pmf in select_action
+        self._pmf_buffer = np.empty(self.task.n_primitive_actions, dtype=float)
+
     def update(self, experience_tuple):
         _, a, aa, r, (loc_prime, c) = experience_tuple
         self.updating_mapping(c, a, aa)
@@ -351,57 +537,71 @@ class ModelBasedAgent(FullInformationAgent):
         self.reward_visits[c, sp] += 1.0
         self.reward_received[c, sp] += r
         self.reward_function[c, sp] = self.reward_received[c, sp] / self.reward_visits[c, sp]
+        self._reward_version += 1
 
     def updating_mapping(self, c, a, aa):
 
         self.mapping_history[c, a, aa] += 1.0
         self.abstract_action_counts[c, aa] += 1.0
 
-        for aa0 in range(self.task.n_abstract_actions):
-            for a0 in range(self.task.n_primitive_actions):
-                self.mapping_mle[c, a0, aa0] = self.mapping_history[c, a0, aa0] / self.abstract_action_counts[c, aa0]
+        # only the counts for abstract action aa changed, so only its MLE
+        # column needs to be renormalized; aa = -1 marks an unbound key press
+        # and addresses the dedicated wait column of the count arrays, which
+        # has no MLE column to refresh
+        if aa != -1:
+            self.mapping_mle[c, :, aa] = self.mapping_history[c, :, aa] / self.abstract_action_counts[c, aa]
 
     def _transitions_to_actions(self, s, sp):
         x, y = self.task.inverse_state_loc_key[s]
         xp, yp = self.task.inverse_state_loc_key[sp]
         return displacement_to_abstract_action(xp - x, yp - y)
 
+    def _greedy_abstract_action(self, state):
+        (x, y), c = state
+
+        key = (self.task.current_trial_number, c, self._reward_version)
+        if self._cached_policy_key != key:
+            self._cached_policy = policy_iteration(
+                self.task.current_trial.transition_function,
+                self.reward_function[c, :],
+                gamma=self.gamma,
+                stop_criterion=self.iteration_criterion)
+            self._cached_policy_key = key
+
+        s = self.task.state_location_key[(x, y)]
+        return self._cached_policy[s]
+
     def select_abstract_action(self, state):
 
         # use epsilon greedy choice function
-        if np.random.rand() > self.epsilon:
-            (x, y), c = state
-            pi = policy_iteration(self.task.current_trial.transition_function,
-                                  self.reward_function[c, :],
-                                  gamma=self.gamma,
-                                  stop_criterion=self.iteration_criterion)
-
-            #
-            s = self.task.state_location_key[(x, y)]
-            abstract_action = pi[s]
+        if self._rng.uniform() > self.epsilon:
+            abstract_action = self._greedy_abstract_action(state)
         else:
-            abstract_action = np.random.randint(self.n_abstract_actions)
+            abstract_action = self._randint(self.n_abstract_actions)
 
         return abstract_action
 
     def select_action(self, state):
 
-        # use epsilon greedy choice function
-        if np.random.rand() > self.epsilon:
+        # single epsilon roll that covers both the abstract and the primitive
+        # choice; going through select_abstract_action here would draw twice
+        if self._rng.uniform() > self.epsilon:
             _, c = state
 
-            abstract_action = self.select_abstract_action(state)
+            abstract_action = self._greedy_abstract_action(state)
 
-            pmf = self.mapping_mle[c, :, abstract_action]
+            # copy into the reusable buffer; operating on the slice directly
+            # would mutate the stored MLE through the view
+            pmf = self._pmf_buffer
+            np.copyto(pmf, self.mapping_mle[c, :, abstract_action])
             for aa0 in range(self.task.n_abstract_actions):
                 if not aa0 == abstract_action:
                     pmf *= (1 - self.mapping_mle[c, :, aa0])
 
-            pmf /= pmf.sum()
-
-            return sample_cmf(pmf.cumsum())
+            cmf = np.cumsum(pmf)
+            return int(np.searchsorted(cmf, self._rng.uniform() * cmf[-1], side='right'))
         else:
-            return np.random.randint(self.n_primitive_actions)
+            return self._randint(self.n_primitive_actions)
 
     def set_reward_prior(self, list_locations):
         """
@@ -426,6 +626,8 @@ class ModelBasedAgent(FullInformationAgent):
             for c in range(self.task.n_ctx):
                 self.reward_function[c, s] = self.reward_received[c, s] / self.reward_visits[c, s]
 
+        self._reward_version += 1
+
 
 class JointClustering(ModelBasedAgent):
 
@@ -456,15 +658,15 @@ class JointClustering(ModelBasedAgent):
 
         self.log_belief = np.ones(1, dtype=float)
 
+        # CRP prior of each hypothesis; only changes when the hypothesis space
+        # does (augment/prune), so it is cached rather than re-fetched per step
+        self._log_prior = np.zeros(1, dtype=float)
+
     def updating_mapping(self, c, a, aa):
-        for h_m in self.mapping_hypotheses:
-            assert type(h_m) is MappingHypothesis
-            h_m.updating_mapping(c, a, aa)
+        update_mapping_batch(self.mapping_hypotheses, c, a, aa)
 
     def update_rewards(self, c, sp, r):
-        for h_r in self.reward_hypotheses:
-            assert type(h_r) is RewardHypothesis
-            h_r.update(c, sp, r)
+        update_reward_batch(self.reward_hypotheses, c, sp, r)
 
     def update(self, experience_tuple):
 
@@ -473,19 +675,13 @@ class JointClustering(ModelBasedAgent):
         sp = self.task.state_location_key[loc_prime]
         self.update_rewards(c, sp, r)
 
-        self.log_belief = np.zeros(len(self.mapping_hypotheses))
-        for ii, h_m in enumerate(self.mapping_hypotheses):
-            self.log_belief[ii] = h_m.get_log_prior()
-
-        # then update the posterior of the belief distribution with the reward posterior
-        for ii, h_r in enumerate(self.reward_hypotheses):
-            assert type(h_r) is RewardHypothesis
-            self.log_belief[ii] += h_r.get_log_likelihood()
-
-        # then update the posterior of the mappings likelihood (prior is shared, only need it once)
-        for ii, h_m in enumerate(self.mapping_hypotheses):
-            assert type(h_m) is MappingHypothesis
-            self.log_belief[ii] += h_m.get_log_likelihood()
+        # single pass: start from the cached prior and accumulate both
+        # likelihood terms (prior is shared, only need it once)
+        log_belief = self._log_prior.copy()
+        for ii in range(len(log_belief)):
+            log_belief[ii] += self.reward_hypotheses[ii].get_log_likelihood() + \
+                self.mapping_hypotheses[ii].get_log_likelihood()
+        self.log_belief = log_belief
 
     def augment_assignments(self, context):
         new_reward_hypotheses = list()
@@ -493,15 +689,13 @@ class JointClustering(ModelBasedAgent):
         new_log_belief = list()
 
         for h_r, h_m in zip(self.reward_hypotheses, self.mapping_hypotheses):
-            assert type(h_r) is RewardHypothesis
-            assert type(h_m) is MappingHypothesis
 
-            old_assignments = h_r.get_assignments()
+            old_assignments = _assignment_to_array(h_r.get_assignments(), context + 1)
             new_assignments = augment_assignments([old_assignments], context)
 
             # create a list of the new clusters to add
             for assignment in new_assignments:
-                k = assignment[context]
+                k = int(assignment[context])
                 h_r0 = h_r.deep_copy()
                 h_r0.add_new_context_assignment(context, k)
 
@@ -514,26 +708,19 @@ class JointClustering(ModelBasedAgent):
 
         self.reward_hypotheses = new_reward_hypotheses
         self.mapping_hypotheses = new_mapping_hypotheses
-        self.log_belief = new_log_belief
+        self.log_belief = np.array(new_log_belief)
+        self._log_prior = np.array([h_m.get_log_prior() for h_m in new_mapping_hypotheses])
 
     def prune_hypothesis_space(self, threshold=50.):
         if threshold is not None:
-            new_log_belief = []
-            new_reward_hypotheses = []
-            new_mapping_hypotheses = []
-            max_belief = np.max(self.log_belief)
+            # one vectorized compare instead of a Python loop over the beliefs
+            log_belief = np.asarray(self.log_belief)
+            keep_idx = np.flatnonzero(log_belief.max() - log_belief < np.log(threshold))
 
-            log_threshold = np.log(threshold)
-
-            for ii, log_b in enumerate(self.log_belief):
-                if max_belief - log_b < log_threshold:
-                    new_log_belief.append(log_b)
-                    new_reward_hypotheses.append(self.reward_hypotheses[ii])
-                    new_mapping_hypotheses.append(self.mapping_hypotheses[ii])
-
-            self.log_belief = new_log_belief
-            self.reward_hypotheses = new_reward_hypotheses
-            self.mapping_hypotheses = new_mapping_hypotheses
+            self.log_belief = log_belief[keep_idx]
+            self._log_prior = self._log_prior[keep_idx]
+            self.reward_hypotheses = [self.reward_hypotheses[ii] for ii in keep_idx]
+            self.mapping_hypotheses = [self.mapping_hypotheses[ii] for ii in keep_idx]
 
     def select_abstract_action(self, state):
         (x, y), c = state
@@ -543,23 +730,17 @@ class JointClustering(ModelBasedAgent):
         h_r = self.reward_hypotheses[ii]
         q_values = h_r.select_abstract_action_pmf(s, c, self.task.current_trial.transition_function)
 
-        full_pmf = np.exp(q_values * self.inverse_temperature)
-        full_pmf = full_pmf / np.sum(full_pmf)
-
-        return sample_cmf(full_pmf.cumsum())
+        return _softmax_sample(q_values, self.inverse_temperature)
 
     def select_action(self, state):
         # use softmax choice function
         _, c = state
         aa = self.select_abstract_action(state)
-        c = np.int32(c)
 
         ii = np.argmax(self.log_belief)
         h_m = self.mapping_hypotheses[ii]
 
-        mapping_mle = np.zeros(self.n_primitive_actions)
-        for a0 in np.arange(self.n_primitive_actions, dtype=np.int32):
-            mapping_mle[a0] = h_m.get_mapping_probability(c, a0, aa)
+        mapping_mle = h_m.get_mapping_probability_vec(int(c), aa)
 
         return sample_cmf(mapping_mle.cumsum())
 
@@ -629,14 +810,10 @@ class IndependentClusterAgent(ModelBasedAgent):
         self.log_belief_map = np.ones(1, dtype=float)
 
     def updating_mapping(self, c, a, aa):
-        for h_m in self.mapping_hypotheses:
-            assert type(h_m) is MappingHypothesis
-            h_m.updating_mapping(c, a, aa)
+        update_mapping_batch(self.mapping_hypotheses, c, a, aa)
 
     def update_rewards(self, c, sp, r):
-        for h_r in self.reward_hypotheses:
-            assert type(h_r) is RewardHypothesis
-            h_r.update(c, sp, r)
+        update_reward_batch(self.reward_hypotheses, c, sp, r)
 
     def update(self, experience_tuple):
 
@@ -645,29 +822,22 @@ class IndependentClusterAgent(ModelBasedAgent):
         sp = self.task.state_location_key[loc_prime]
         self.update_rewards(c, sp, r)
 
-        # then update the posterior of the rewards
-        for ii, h_r in enumerate(self.reward_hypotheses):
-            assert type(h_r) is RewardHypothesis
-            self.log_belief_rew[ii] = h_r.get_log_posterior()
-
-        # then update the posterior of the mappings
-        for ii, h_m in enumerate(self.mapping_hypotheses):
-            assert type(h_m) is MappingHypothesis
-            self.log_belief_map[ii] = h_m.get_log_posterior()
+        # then update the posteriors of the rewards and mappings
+        self.log_belief_rew = get_log_posterior_batch(self.reward_hypotheses)
+        self.log_belief_map = get_log_posterior_batch(self.mapping_hypotheses)
 
     def augment_assignments(self, context):
         new_hypotheses = list()
         new_log_belief = list()
 
         for h_r in self.reward_hypotheses:
-            assert type(h_r) is RewardHypothesis
 
-            old_assignments = h_r.get_assignments()
+            old_assignments = _assignment_to_array(h_r.get_assignments(), context + 1)
             new_assignments = augment_assignments([old_assignments], context)
 
             # create a list of the new clusters to add
             for assignment in new_assignments:
-                k = assignment[context]
+                k = int(assignment[context])
                 h_r0 = h_r.deep_copy()
                 h_r0.add_new_context_assignment(context, k)
 
@@ -675,20 +845,19 @@ class IndependentClusterAgent(ModelBasedAgent):
                 new_log_belief.append(h_r0.get_log_prior() + h_r0.get_log_likelihood())
 
         self.reward_hypotheses = new_hypotheses
-        self.log_belief_rew = new_log_belief
+        self.log_belief_rew = np.array(new_log_belief)
 
         new_hypotheses = list()
         new_log_belief = list()
 
         for h_m in self.mapping_hypotheses:
-            assert type(h_m) is MappingHypothesis
 
-            old_assignments = h_m.get_assignments()
+            old_assignments = _assignment_to_array(h_m.get_assignments(), context + 1)
             new_assignments = augment_assignments([old_assignments], context)
 
             # create a list of the new clusters to add
             for assignment in new_assignments:
-                k = assignment[context]
+                k = int(assignment[context])
                 h_m0 = h_m.deep_copy()
                 h_m0.add_new_context_assignment(context, k)
 
@@ -696,34 +865,22 @@ class IndependentClusterAgent(ModelBasedAgent):
                 new_log_belief.append(h_m0.get_log_prior() + h_m0.get_log_likelihood())
 
         self.mapping_hypotheses = new_hypotheses
-        self.log_belief_map = new_log_belief
+        self.log_belief_map = np.array(new_log_belief)
 
     def prune_hypothesis_space(self, threshold=50.):
         if threshold is not None:
-            new_log_belief_rew = []
-            new_reward_hypotheses = []
-            max_belief = np.max(self.log_belief_rew)
-
             log_threshold = np.log(threshold)
 
-            for ii, log_b in enumerate(self.log_belief_rew):
-                if max_belief - log_b < log_threshold:
-                    new_log_belief_rew.append(log_b)
-                    new_reward_hypotheses.append(self.reward_hypotheses[ii])
-
-            self.log_belief_rew = new_log_belief_rew
-            self.reward_hypotheses = new_reward_hypotheses
+            # one vectorized compare per belief vector instead of Python loops
+            log_belief_rew = np.asarray(self.log_belief_rew)
+            keep_idx = np.flatnonzero(log_belief_rew.max() - log_belief_rew < log_threshold)
+            self.log_belief_rew = log_belief_rew[keep_idx]
+            self.reward_hypotheses = [self.reward_hypotheses[ii] for ii in keep_idx]
 
-            new_log_belief_map = []
-            new_mapping_hypotheses = []
-            max_belief = np.max(self.log_belief_map)
-            for ii, log_b in enumerate(self.log_belief_map):
-                if max_belief - log_b < log_threshold:
-                    new_log_belief_map.append(log_b)
-                    new_mapping_hypotheses.append(self.mapping_hypotheses[ii])
-
-            self.log_belief_map = new_log_belief_map
-            self.mapping_hypotheses = new_mapping_hypotheses
+            log_belief_map = np.asarray(self.log_belief_map)
+            keep_idx = np.flatnonzero(log_belief_map.max() - log_belief_map < log_threshold)
+            self.log_belief_map = log_belief_map[keep_idx]
+            self.mapping_hypotheses = [self.mapping_hypotheses[ii] for ii in keep_idx]
 
     def select_abstract_action(self, state):
         # use softmax greedy choice function
@@ -737,10 +894,7 @@ class IndependentClusterAgent(ModelBasedAgent):
             s, c, self.task.current_trial.transition_function
         )
 
-        full_pmf = np.exp(q_values * self.inverse_temperature)
-        full_pmf = full_pmf / np.sum(full_pmf)
-
-        return sample_cmf(full_pmf.cumsum())
+        return _softmax_sample(q_values, self.inverse_temperature)
 
     def get_reward_function(self, state):
         _, c = state
@@ -790,9 +944,9 @@ class IndependentClusterAgent(ModelBasedAgent):
 
         # normalize both
         # map_q_values = np.exp(map_q_values * self.inverse_temperature)
-        map_q_values /= np.sum(map_q_values)
+        map_q_values *= 1.0 / map_q_values.sum()
         # full_q_values = np.exp(full_q_values * self.inverse_temperature)
-        full_q_values /= np.sum(full_q_values)
+        full_q_values *= 1.0 / full_q_values.sum()
 
         return kl_divergence(map_q_values, full_q_values), map_q_values, full_q_values
 
@@ -800,14 +954,11 @@ class IndependentClusterAgent(ModelBasedAgent):
         # use softmax greedy choice function
         _, c = state
         aa = self.select_abstract_action(state)
-        c = np.int32(c)
 
         ii = np.argmax(self.log_belief_map)
         h_m = self.mapping_hypotheses[ii]
 
-        mapping_mle = np.zeros(self.n_primitive_actions)
-        for a0 in np.arange(self.n_primitive_actions, dtype=np.int32):
-            mapping_mle[a0] = h_m.get_mapping_probability(c, a0, aa)
+        mapping_mle = h_m.get_mapping_probability_vec(int(c), aa)
 
         return sample_cmf(mapping_mle.cumsum())
 
@@ -815,28 +966,25 @@ class IndependentClusterAgent(ModelBasedAgent):
         # Get the q-values over abstract actions
         _, c = state
         aa = self.select_abstract_action(state)
-        c = np.int32(c)
+        c = int(c)
 
         ii = np.argmax(self.log_belief_map)
         h_m = self.mapping_hypotheses[ii]
 
-        map_mapping_mle = np.zeros(self.n_primitive_actions)
-        for a0 in np.arange(self.n_primitive_actions, dtype=np.int32):
-            map_mapping_mle[a0] = h_m.get_mapping_probability(c, a0, aa)
+        map_mapping_mle = h_m.get_mapping_probability_vec(c, aa)
 
         # get the full posterior
         belief = np.exp(self.log_belief_map - np.max(self.log_belief_map))
-        belief /= np.sum(belief)
+        belief *= 1.0 / belief.sum()
 
         full_mapping_mle = np.zeros(self.n_primitive_actions)
         for ii, p in enumerate(belief):
             h_m = self.mapping_hypotheses[ii]
-            for a0 in np.arange(self.n_primitive_actions, dtype=np.int32):
-                full_mapping_mle[a0] += h_m.get_mapping_probability(c, a0, aa) * p
+            full_mapping_mle += h_m.get_mapping_probability_vec(c, aa) * p
 
         # normalize both
-        map_mapping_mle /= np.sum(map_mapping_mle)
-        full_mapping_mle /= np.sum(full_mapping_mle)
+        map_mapping_mle *= 1.0 / map_mapping_mle.sum()
+        full_mapping_mle *= 1.0 / full_mapping_mle.sum()
 
         return kl_divergence(map_mapping_mle, full_mapping_mle)
 
@@ -861,9 +1009,9 @@ class IndependentThompson(IndependentClusterAgent):
 
         # exponentiate and normalize.
         b = np.exp(self.log_belief_rew - np.max(self.log_belief_rew))
-        b /= b.sum()
+        b *= 1.0 / b.sum()
         cdf = np.cumsum(b)
-        X = np.sum(np.random.rand() < cdf) - 1
+        X = np.sum(self._rng.uniform() < cdf) - 1
 
         h_r = self.reward_hypotheses[X]
 
@@ -919,7 +1067,7 @@ class MetaAgent(ModelBasedAgent):
 
 
     def choose_operating_model(self):
-        if np.random.rand() < self.get_joint_probability():
+        if self._rng.uniform() < self.get_joint_probability():
             self.current_agent = self.joint_agent
             self.current_agent_name = 'Joint'
         else:
@@ -1001,7 +1149,7 @@ class RLMetaAgent(ModelBasedAgent):
         return np.exp(self.beta * self.responsibilities['Joint'] -  k)
 
     def choose_operating_model(self):
-        if np.random.rand() < self.get_joint_probability():
+        if self._rng.uniform() < self.get_joint_probability():
             self.current_agent = self.joint_agent
             self.current_agent_name = 'Joint'
         else:
@@ -1074,28 +1222,24 @@ class IndependentClusterAgentFullBayes(IndependentClusterAgent):
                 s, c, self.task.current_trial.transition_function
             ) * p
 
-        full_pmf = np.exp(q_values * self.inverse_temperature)
-        full_pmf = full_pmf / np.sum(full_pmf)
-
-        return sample_cmf(full_pmf.cumsum())
+        return _softmax_sample(q_values, self.inverse_temperature)
 
     def select_action(self, state):
         # use softmax greedy choice function
         _, c = state
         aa = self.select_abstract_action(state)
-        c = np.int32(c)
+        c = int(c)
 
         # get the full posterior
         belief = np.exp(self.log_belief_map - np.max(self.log_belief_map))
-        belief /= np.sum(belief)
+        belief *= 1.0 / belief.sum()
 
         mapping_mle = np.zeros(self.n_primitive_actions)
         for ii, p in enumerate(belief):
             h_m = self.mapping_hypotheses[ii]
-            for a0 in np.arange(self.n_primitive_actions, dtype=np.int32):
-                mapping_mle[a0] += h_m.get_mapping_probability(c, a0, aa) * p
+            mapping_mle += h_m.get_mapping_probability_vec(c, aa) * p
 
-        mapping_mle /= np.sum(mapping_mle)
+        mapping_mle *= 1.0 / mapping_mle.sum()
         return sample_cmf(mapping_mle.cumsum())
 
 
@@ -1120,32 +1264,24 @@ class FlatControlAgent(ModelBasedAgent):
         self.n_abstract_actions = self.task.n_abstract_actions
         self.n_primitive_actions = self.task.n_primitive_actions
 
-        # create task sets, each containing a reward and mapping hypothesis
-        # with the same assignment
-        self.task_sets = [{
-                'Reward Hypothesis': RewardHypothesis(
-                    self.task.n_states, inverse_temperature, discount_rate,
-                    iteration_criterion, alpha
-                ),
-                'Mapping Hypothesis': MappingHypothesis(
-                    self.task.n_primitive_actions, self.task.n_abstract_actions,
-                    alpha, mapping_prior
-                ),
-            }]
+        # parallel lists of reward and mapping hypotheses; entry ii of each
+        # shares the same (flat) assignment
+        self.reward_hypotheses = [RewardHypothesis(
+                self.task.n_states, inverse_temperature, discount_rate,
+                iteration_criterion, alpha
+            )]
+        self.mapping_hypotheses = [MappingHypothesis(
+                self.task.n_primitive_actions, self.task.n_abstract_actions,
+                alpha, mapping_prior
+            )]
 
         self.log_belief = np.ones(1)
 
     def updating_mapping(self, c, a, aa):
-        for ts in self.task_sets:
-            h_m = ts['Mapping Hypothesis']
-            assert type(h_m) is MappingHypothesis
-            h_m.updating_mapping(c, a, aa)
+        update_mapping_batch(self.mapping_hypotheses, c, a, aa)
 
     def update_rewards(self, c, sp, r):
-        for ts in self.task_sets:
-            h_r = ts['Reward Hypothesis']
-            assert type(h_r) is RewardHypothesis
-            h_r.update(c, sp, r)
+        update_reward_batch(self.reward_hypotheses, c, sp, r)
 
     def update(self, experience_tuple):
 
@@ -1156,57 +1292,44 @@ class FlatControlAgent(ModelBasedAgent):
         self.update_rewards(c, sp, r)
 
         # then update the posterior
-        for ii, ts in enumerate(self.task_sets):
-            h_m = ts['Mapping Hypothesis']
-            h_r = ts['Reward Hypothesis']
-
-            assert type(h_m) is MappingHypothesis
-            assert type(h_r) is RewardHypothesis
+        for ii in range(len(self.mapping_hypotheses)):
+            h_m = self.mapping_hypotheses[ii]
+            h_r = self.reward_hypotheses[ii]
 
             self.log_belief[ii] = h_m.get_log_prior() + \
                 h_m.get_log_likelihood() + h_r.get_log_likelihood()
 
     def augment_assignments(self, context):
 
-        ts = self.task_sets[0]
-        h_m = ts['Mapping Hypothesis']
-        h_r = ts['Reward Hypothesis']
-        assert type(h_m) is MappingHypothesis
-        assert type(h_r) is RewardHypothesis
+        h_r = self.reward_hypotheses[0]
+        h_m = self.mapping_hypotheses[0]
 
         h_m.add_new_context_assignment(context, context)
         h_r.add_new_context_assignment(context, context)
 
-        self.task_sets = [{'Reward Hypothesis': h_r, 'Mapping Hypothesis': h_m}]
-        self.log_belief = [1]
+        self.log_belief = np.ones(1)
 
     def select_abstract_action(self, state):
         (x, y), c = state
         s = self.task.state_location_key[(x, y)]
 
         ii = np.argmax(self.log_belief)
-        h_r = self.task_sets[ii]['Reward Hypothesis']
+        h_r = self.reward_hypotheses[ii]
         q_values = h_r.select_abstract_action_pmf(
             s, c, self.task.current_trial.transition_function
         )
 
-        full_pmf = np.exp(q_values * self.inverse_temperature)
-        full_pmf = full_pmf / np.sum(full_pmf)
-
-        return sample_cmf(full_pmf.cumsum())
+        return _softmax_sample(q_values, self.inverse_temperature)
 
     def select_action(self, state):
 
         _, c = state
         aa = self.select_abstract_action(state)
-        c = np.int32(c)
 
         ii = np.argmax(self.log_belief)
-        h_m = self.task_sets[ii]['Mapping Hypothesis']
+        h_m = self.mapping_hypotheses[ii]
 
-        mapping_mle = np.zeros(self.n_primitive_actions)
-        for a0 in np.arange(self.n_primitive_actions, dtype=np.int32):
-            mapping_mle[a0] = h_m.get_mapping_probability(c, a0, aa)
+        mapping_mle = h_m.get_mapping_probability_vec(int(c), aa)
 
         return sample_cmf(mapping_mle.cumsum())
 
@@ -1215,13 +1338,13 @@ class FlatControlAgent(ModelBasedAgent):
         _, c = state
 
         ii = np.argmax(self.log_belief)
-        h_r = self.task_sets[ii]['Reward Hypothesis']
+        h_r = self.reward_hypotheses[ii]
         return h_r.get_reward_function(c)
 
     def get_transition_error(self, state):
         _, c = state
         ii = np.argmax(self.log_belief)
-        h = self.task_sets[ii]['Mapping Hypothesis']
+        h = self.mapping_hypotheses[ii]
 
         t = 0
         q = np.zeros(self.task.n_primitive_actions * self.task.n_abstract_actions)
@@ -1240,10 +1363,10 @@ class MapClusteringAgent(ModelBasedAgent):
 
     def __init__(self, task, inverse_temperature=100.0, alpha=1.0, discount_rate=0.8,
                  iteration_criterion=0.01,
-                 mapping_prior=0.01, epsilon=0.025):
+                 mapping_prior=0.01, epsilon=0.025, seed=None):
 
         assert type(task) is Task
-        super(FullInformationAgent, self).__init__(task)
+        super(FullInformationAgent, self).__init__(task, seed=seed)
 
         self.inverse_temperature = inverse_temperature
         self.gamma = discount_rate
@@ -1277,93 +1400,134 @@ class MapClusteringAgent(ModelBasedAgent):
                 ),
             )
 
-        self.belief_rew = np.ones(len(self.reward_hypotheses)) /\
-            float(len(self.reward_hypotheses))
+        # beliefs are kept in log space (log posterior minus log-sum-exp);
+        # exponentiation is deferred until the probabilities are needed
+        self.log_belief_rew = np.full(len(self.reward_hypotheses),
+                                      -np.log(float(len(self.reward_hypotheses))))
+
+        self.log_belief_map = np.full(len(self.mapping_hypotheses),
+                                      -np.log(float(len(self.mapping_hypotheses))))
+
+        # reusable buffers for collecting the log posteriors each step
+        self._log_post_rew = np.zeros(len(self.reward_hypotheses))
+        self._log_post_map = np.zeros(len(self.mapping_hypotheses))
+
+        # scratch buffers for action selection
+        self._map_scratch = np.zeros(self.n_primitive_actions)
+        self._pmf_stack = np.empty((len(self.reward_hypotheses), self.n_abstract_actions))
 
-        self.belief_map = np.ones(len(self.mapping_hypotheses)) /\
-            float(len(self.mapping_hypotheses))
+        # indices of reward hypotheses with non-negligible posterior mass;
+        # only these contribute to the action mixture
+        self._active_rew = np.arange(len(self.reward_hypotheses))
+        self._log_active_threshold = np.log(1e-8)
+
+        # the location-to-state key never changes; skip the attribute walk
+        self._state_location_key = self.task.state_location_key
+
+        # index of the MAP mapping hypothesis, refreshed with the posterior
+        self._map_argmax = 0
+
+        # pool of uniform draws, refilled in chunks; a vectorized draw is far
+        # cheaper per sample than one generator call per step
+        self._rand_buf = self._rng.uniform(size=1024)
+        self._rand_ptr = 0
+
+    def _draw_uniform(self):
+        if self._rand_ptr >= len(self._rand_buf):
+            self._rand_buf = self._rng.uniform(size=1024)
+            self._rand_ptr = 0
+        u = self._rand_buf[self._rand_ptr]
+        self._rand_ptr += 1
+        return u
 
     def updating_mapping(self, c, a, aa):
-        for h_m in self.mapping_hypotheses:
-            assert type(h_m) is MappingHypothesis
-            h_m.updating_mapping(c, a, aa)
+        update_mapping_batch(self.mapping_hypotheses, c, a, aa)
 
     def update_rewards(self, c, sp, r):
-        for h_r in self.reward_hypotheses:
-            assert type(h_r) is RewardHypothesis
-            h_r.update(c, sp, r)
+        update_reward_batch(self.reward_hypotheses, c, sp, r)
+
+    def _update_belief(self, hypotheses, log_posterior):
+        """ normalize the hypotheses' log posterior into the passed buffer, in place.
+
+        Collects the log posteriors in a single compiled loop and subtracts
+        the log-sum-exp (max shifted, so the exponentials stay stable). The
+        result stays in log space; callers exponentiate only when they need
+        the probabilities themselves.
+        """
+        log_posterior[:] = get_log_posterior_batch(hypotheses)
+
+        return _normalize_log_posterior(log_posterior)
 
     def update(self, experience_tuple):
 
         # super(FlatAgent, self).update(experience_tuple)
         _, a, aa, r, (loc_prime, c) = experience_tuple
         self.updating_mapping(c, a, aa)
-        sp = self.task.state_location_key[loc_prime]
+        sp = self._state_location_key[loc_prime]
         self.update_rewards(c, sp, r)
 
-        # then update the posterior of the rewards
-        belief = np.zeros(len(self.reward_hypotheses))
-        for ii, h_r in enumerate(self.reward_hypotheses):
-            assert type(h_r) is RewardHypothesis
-            log_posterior = h_r.get_log_posterior()
-            belief[ii] = np.exp(log_posterior)
-
-        # normalize the posterior
-        belief /= np.sum(belief)
-
-        self.belief_rew = belief
+        # then update the posteriors of the rewards and the mappings
+        self.log_belief_rew = self._update_belief(self.reward_hypotheses, self._log_post_rew)
+        self.log_belief_map = self._update_belief(self.mapping_hypotheses, self._log_post_map)
 
-        # then update the posterior of the mappings
-        belief = np.zeros(len(self.mapping_hypotheses))
-        for ii, h_m in enumerate(self.mapping_hypotheses):
-            assert type(h_m) is MappingHypothesis
-            log_posterior = h_m.get_log_posterior()
-            belief[ii] = np.exp(log_posterior)
+        # hypotheses with (numerically) zero posterior cannot move the
+        # mixture, so remember which ones are worth evaluating; the log
+        # beliefs are normalized, so this is the same test as p > 1e-8
+        self._active_rew = np.flatnonzero(self.log_belief_rew > self._log_active_threshold)
 
-        # normalize the posterior
-        belief /= np.sum(belief)
+        # the MAP mapping only changes when the posterior does, so find the
+        # argmax here rather than on every action selection (monotone, so the
+        # log beliefs give the same argmax without exponentiating)
+        self._map_argmax = int(np.argmax(self.log_belief_map))
 
-        self.belief_map = belief
+    def _select_abstract_action_core(self, state):
+        """ greedy abstract action draw, shared by both entry points; returns
+        the context along with the action so select_action can reuse it
+        without re-unpacking the state """
+        (x, y), c = state
+        s = self._state_location_key[(x, y)]
+
+        # stack the pmfs of the active hypotheses, then mix them with the
+        # posterior (calculated during the update) as a single
+        # matrix-vector product
+        active = self._active_rew
+        pmf_stack = self._pmf_stack
+        for jj, ii in enumerate(active):
+            pmf_stack[jj] = self.reward_hypotheses[ii].select_abstract_action_pmf(
+                s, c, self.task.current_trial.transition_function)
+
+        # mixing, softmax and the categorical draw are fused into one
+        # kernel call (compiled when numba is available)
+        aa = int(_sample_abstract_action(
+            pmf_stack[:len(active)], self.log_belief_rew[active],
+            self.inverse_temperature, self._draw_uniform()))
+        return aa, c
 
     def select_abstract_action(self, state):
         # use epsilon greedy choice function
-        if np.random.rand() > self.epsilon:
-            (x, y), c = state
-            s = self.task.state_location_key[(x, y)]
-
-            q_values = np.zeros(self.n_abstract_actions)
-            for ii, h_r in enumerate(self.reward_hypotheses):
-                # need the posterior (which is calculated during the update) and the
-                #  pmf from the reward function
-                assert type(h_r) is RewardHypothesis
-                q_values += h_r.select_abstract_action_pmf(
-                    s, c, self.task.current_trial.transition_function) * \
-                            self.belief_rew[ii]
-
-            full_pmf = np.exp(q_values * self.inverse_temperature)
-            full_pmf = full_pmf / np.sum(full_pmf)
-
-            return sample_cmf(full_pmf.cumsum())
+        if self._draw_uniform() > self.epsilon:
+            aa, _ = self._select_abstract_action_core(state)
+            return aa
         else:
-            return np.random.randint(self.n_abstract_actions)
+            return self._randint(self.n_abstract_actions)
 
     def select_action(self, state):
-        # use epsilon greedy choice function
-        if np.random.rand() > self.epsilon:
-            _, c = state
-            aa = self.select_abstract_action(state)
-            c = np.int32(c)
+        # use epsilon greedy choice function; a single roll covers the whole
+        # decision instead of separate rolls at the abstract and primitive
+        # levels
+        if self._draw_uniform() > self.epsilon:
+            aa, c = self._select_abstract_action_core(state)
 
-            ii = np.argmax(self.belief_map)
-            h_m = self.mapping_hypotheses[ii]
+            h_m = self.mapping_hypotheses[self._map_argmax]
 
-            mapping_mle = np.zeros(self.n_primitive_actions)
-            for a0 in np.arange(self.n_primitive_actions, dtype=np.int32):
-                mapping_mle[a0] = h_m.get_mapping_probability(c, a0, aa)
+            mapping_mle = self._map_scratch
+            np.copyto(mapping_mle, h_m.get_mapping_probability_vec(int(c), aa))
 
-            return sample_cmf(mapping_mle.cumsum())
+            # cumulate in place and binary-search the cmf directly
+            np.cumsum(mapping_mle, out=mapping_mle)
+            return int(np.searchsorted(mapping_mle, self._draw_uniform(), side='right'))
         else:
-            return np.random.randint(self.n_primitive_actions)
+            return self._randint(self.n_primitive_actions)
 
 
 class FlatTransitionAgent(FullInformationAgent):
@@ -1408,18 +1572,16 @@ class FlatTransitionAgent(FullInformationAgent):
 
     def update_transitions(self, c, s, a, sp):
         for h_t in self.transition_hypotheses:
-            assert type(h_t) is TransitionHypothesis
             h_t.update(c, s, a, sp)
 
     def update_rewards(self, c, sp, r):
         for h_r in self.reward_hypotheses:
-            assert type(h_r) is RewardHypothesis
             h_r.update(c, sp, r)
 
     def select_action(self, state):
 
         # use epsilon greedy choice function, with thompson sampling over hypotheses (b/c rewards are deterministic!)
-        if np.random.rand() > self.epsilon:
+        if self._rng.uniform() > self.epsilon:
             (loc), c = state
             s = self.task.state_location_key[loc]
 
@@ -1431,13 +1593,11 @@ class FlatTransitionAgent(FullInformationAgent):
             ii = thompson_sample(pmf_t)
             # ii = np.argmax(self.log_belief_transitions)
             h_t = self.transition_hypotheses[ii]
-            assert type(h_t) is TransitionHypothesis
             transition_function = np.asarray(h_t.get_transition_function(c))
 
             ii = thompson_sample(pmf_r)
             # ii = np.argmax(self.log_belief_rewards)
             h_r = self.reward_hypotheses[ii]
-            assert type(h_r) is RewardHypothesis
             reward_function = h_r.get_reward_function(c)
 
             v = value_iteration(transition_function, reward_function,
@@ -1456,7 +1616,7 @@ class FlatTransitionAgent(FullInformationAgent):
 
             return sample_cmf(full_pmf.cumsum())
         else:
-            action = np.random.randint(self.n_actions)
+            action = self._randint(self.n_actions)
 
         return action
 
@@ -1493,8 +1653,6 @@ class FlatTransitionAgent(FullInformationAgent):
         h_r = self.reward_hypotheses[0]
         h_t = self.transition_hypotheses[0]
 
-        assert type(h_r) is RewardHypothesis
-        assert type(h_t) is TransitionHypothesis
 
         h_r.add_new_context_assignment(context, context)
         h_t.add_new_context_assignment(context, context)
@@ -1546,15 +1704,13 @@ class JointTransitionAgent(FlatTransitionAgent):
         new_log_belief = list()
 
         for h_r, h_t in zip(self.reward_hypotheses, self.transition_hypotheses):
-            assert type(h_r) is RewardHypothesis
-            assert type(h_t) is TransitionHypothesis
 
-            old_assignments = h_r.get_assignments()
+            old_assignments = _assignment_to_array(h_r.get_assignments(), context + 1)
             new_assignments = augment_assignments([old_assignments], context)
 
             # create a list of the new clusters to add
             for assignment in new_assignments:
-                k = assignment[context]
+                k = int(assignment[context])
                 h_r0 = h_r.deep_copy()
                 h_r0.add_new_context_assignment(context, k)
 
@@ -1580,13 +1736,11 @@ class JointTransitionAgent(FlatTransitionAgent):
         self.log_belief_transitions = np.zeros(len(self.transition_hypotheses))
         self.log_belief_rewards = np.zeros(len(self.log_belief_rewards))
         for ii, h_t in enumerate(self.transition_hypotheses):
-            assert type(h_t) is TransitionHypothesis
             self.log_belief_transitions[ii] = h_t.get_log_prior()
             self.log_belief_rewards[ii]     = h_t.get_log_prior()
 
         # then update the posterior of the belief distribution with the reward posterior
         for ii, h_r in enumerate(self.reward_hypotheses):
-            assert type(h_r) is RewardHypothesis
 
             self.log_belief_transitions[ii] += h_r.get_log_likelihood()
             self.log_belief_rewards[ii]     += h_r.get_log_likelihood()
@@ -1642,14 +1796,13 @@ class IndependentTransitionAgent(FlatTransitionAgent):
         new_log_belief_trans = list()
 
         for h_r in self.reward_hypotheses:
-            assert type(h_r) is RewardHypothesis
 
-            old_assignments = h_r.get_assignments()
+            old_assignments = _assignment_to_array(h_r.get_assignments(), context + 1)
             new_assignments = augment_assignments([old_assignments], context)
 
             # create a list of the new clusters to add
             for assignment in new_assignments:
-                k = assignment[context]
+                k = int(assignment[context])
                 h_r0 = h_r.deep_copy()
                 h_r0.add_new_context_assignment(context, k)
 
@@ -1660,14 +1813,13 @@ class IndependentTransitionAgent(FlatTransitionAgent):
         self.log_belief_rewards = new_log_belief_rew
 
         for h_t in self.transition_hypotheses:
-            assert type(h_t) is TransitionHypothesis
 
-            old_assignments = h_t.get_assignments()
+            old_assignments = _assignment_to_array(h_t.get_assignments(), context + 1)
             new_assignments = augment_assignments([old_assignments], context)
 
             # create a list of the new clusters to add
             for assignment in new_assignments:
-                k = assignment[context]
+                k = int(assignment[context])
                 h_t0 = h_t.deep_copy()
                 h_t0.add_new_context_assignment(context, k)
 
@@ -1684,13 +1836,11 @@ class IndependentTransitionAgent(FlatTransitionAgent):
         # first, update the transition cluster posterior
         self.log_belief_transitions = np.zeros(len(self.log_belief_transitions))
         for ii, h_t in enumerate(self.transition_hypotheses):
-            assert type(h_t) is TransitionHypothesis
             self.log_belief_transitions[ii] = h_t.get_log_posterior()
 
         # then update the posterior of the belief distribution with the reward posterior
         self.log_belief_rewards = np.zeros(len(self.log_belief_rewards))
         for ii, h_r in enumerate(self.reward_hypotheses):
-            assert type(h_r) is RewardHypothesis
             self.log_belief_rewards[ii]     += h_r.get_log_posterior()
 
 
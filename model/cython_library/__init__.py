@@ -1,6 +1,7 @@
 from core import policy_iteration, value_iteration
-from core import get_prior_log_probability
+from core import get_prior_log_probability, get_log_posterior_batch
 from hypotheses import MappingHypothesis, RewardHypothesis
+from hypotheses import update_reward_batch, update_mapping_batch
 from transition_hypothesis import TransitionHypothesis
 from rooms_hypotheses import GoalHypothesis
 from rooms_hypotheses import MappingHypothesis as R_MappingHypothesis
@@ -109,6 +109,21 @@ cpdef np.ndarray[DTYPE_t] value_iteration(
             return np.array(V)
 
 
+cpdef np.ndarray[DTYPE_t, ndim=1] get_log_posterior_batch(list hypotheses):
+    """Collect get_log_posterior() from a list of hypotheses in one call.
+
+    Works for any hypothesis type that exposes get_log_posterior; the loop
+    keeps the GIL since the hypotheses hold python dict/list state.
+    """
+    cdef int ii, n = len(hypotheses)
+    cdef np.ndarray[DTYPE_t, ndim=1] log_posterior = np.zeros(n, dtype=DTYPE)
+
+    for ii in range(n):
+        log_posterior[ii] = hypotheses[ii].get_log_posterior()
+
+    return log_posterior
+
+
 cpdef double get_prior_log_probability(dict ctx_assignment, double alpha):
     """This takes in an assignment of contexts to groups and returns the
     prior probability over the assignment using a CRP
@@ -23,6 +23,9 @@ cdef class MappingCluster(object):
     cdef double [:] abstract_action_counts, primitive_action_counts
     cdef int n_primitive_actions, n_abstract_actions
     cdef double mapping_prior
+    # set when the cluster is shared between hypotheses after a deep_copy;
+    # writers duplicate the cluster first (copy on write)
+    cdef public bint _shared
 
     def __init__(self, int n_primitive_actions, int n_abstract_actions, float mapping_prior):
 
@@ -47,6 +50,7 @@ cdef class MappingCluster(object):
         self.n_primitive_actions = n_primitive_actions
         self.n_abstract_actions = n_abstract_actions
         self.mapping_prior = mapping_prior
+        self._shared = False
 
     def update(self, int a, int aa):
         cdef int aa0, a0
@@ -64,6 +68,10 @@ cdef class MappingCluster(object):
     def get_mapping_mle(self, int a, int aa):
         return self.mapping_mle[a, aa]
 
+    def get_mapping_mle_vec(self, int aa):
+        # copy of the MLE column over all primitive actions
+        return np.array(self.mapping_mle[:, aa])
+
     def get_likelihood(self, int a, int aa):
         return self.pr_aa_given_a[a, aa]
 
@@ -92,6 +100,10 @@ cdef class MappingHypothesis(object):
         cdef double prior_log_prob, alpha, mapping_prior
         cdef list experience
         cdef int n_abstract_actions, n_primitive_actions
+        # cached log likelihood; only recomputed after new experience, since
+        # reassigning contexts changes the prior but not the likelihood
+        cdef double _ll_cache
+        cdef bint _ll_dirty
 
         def __init__(self, int n_primitive_actions, int n_abstract_actions, float alpha, float mapping_prior):
 
@@ -110,6 +122,9 @@ cdef class MappingHypothesis(object):
             # need to store all experiences for log probability calculations
             self.experience = list()
 
+            self._ll_cache = 0
+            self._ll_dirty = False
+
         cdef _update_prior(self):
             self.prior_log_prob = get_prior_log_probability(self.cluster_assignments, self.alpha)
 
@@ -123,11 +138,18 @@ cdef class MappingHypothesis(object):
             cdef int k, a, aa, c
             cdef MappingCluster cluster
 
-            # deep copy each list, dictionary, cluster, etc
+            # share the clusters with the copy; they are duplicated lazily on
+            # the first write (most children of an augmentation never touch
+            # most of their clusters)
+            for cluster in self.clusters.itervalues():
+                cluster._shared = True
+
             _h_copy.cluster_assignments = {c: k for c, k in self.cluster_assignments.iteritems()}
-            _h_copy.clusters = {k: cluster.deep_copy() for k, cluster in self.clusters.iteritems()}
+            _h_copy.clusters = {k: cluster for k, cluster in self.clusters.iteritems()}
             _h_copy.experience = [(k, a, aa) for k, a, aa in self.experience]
             _h_copy.prior_log_prob = get_prior_log_probability(_h_copy.cluster_assignments, _h_copy.alpha)
+            _h_copy._ll_cache = self._ll_cache
+            _h_copy._ll_dirty = self._ll_dirty
             return _h_copy
 
         def add_new_context_assignment(self, int c, int k):
@@ -150,22 +172,30 @@ cdef class MappingHypothesis(object):
         def updating_mapping(self, int c, int a, int aa):
             cdef int k = self.cluster_assignments[c]
             cdef MappingCluster cluster = self.clusters[k]
+            if cluster._shared:
+                cluster = cluster.deep_copy()
             cluster.update(a, aa)
             self.clusters[k] = cluster
 
             # need to store all experiences for log probability calculations
             self.experience.append((k, a, aa))
+            self._ll_dirty = True
 
         def get_log_likelihood(self):
             cdef double log_likelihood = 0
             cdef int k, a, aa
             cdef MappingCluster cluster
 
+            if not self._ll_dirty:
+                return self._ll_cache
+
             #loop through experiences and get posterior
             for k, a, aa in self.experience:
                 cluster = self.clusters[k]
                 log_likelihood += log(cluster.get_likelihood(a, aa))
 
+            self._ll_cache = log_likelihood
+            self._ll_dirty = False
             return log_likelihood
 
         def get_log_posterior(self):
@@ -175,6 +205,10 @@ cdef class MappingHypothesis(object):
             cdef MappingCluster cluster = self.clusters[self.cluster_assignments[c]]
             return cluster.get_mapping_mle(a, aa)
 
+        def get_mapping_probability_vec(self, int c, int aa):
+            cdef MappingCluster cluster = self.clusters[self.cluster_assignments[c]]
+            return cluster.get_mapping_mle_vec(aa)
+
         def get_log_prior(self):
             return self.prior_log_prob
 
@@ -182,6 +216,9 @@ cdef class MappingHypothesis(object):
 cdef class RewardCluster(object):
     cdef double [:] reward_visits, reward_received, reward_function, reward_received_bool
     cdef double [:, ::1] reward_probability
+    # set when the cluster is shared between hypotheses after a deep_copy;
+    # writers duplicate the cluster first (copy on write)
+    cdef public bint _shared
 
     def __init__(self, int n_stim):
         # rewards!
@@ -193,6 +230,8 @@ cdef class RewardCluster(object):
         self.reward_received_bool = np.ones(n_stim) * 1e-2
         self.reward_probability   = np.ones((n_stim, 2)) * (1e-2/2e-2)
 
+        self._shared = False
+
     def update(self, int sp, int r):
         self.reward_visits[sp] += 1.0
         self.reward_received[sp] += (r == 1.0)
@@ -259,6 +298,15 @@ cdef class RewardHypothesis(object):
     cdef double [:,::1] reward_visits, reward_received, reward_function, reward_received_bool
     cdef double [:,:,::1] reward_probability
     cdef list experience
+    # cached log likelihood; only recomputed after new experience, since
+    # reassigning contexts changes the prior but not the likelihood
+    cdef double _ll_cache
+    cdef bint _ll_dirty
+    # cache of the last select_abstract_action_pmf call; back-to-back calls
+    # within a decision step repeat the same (s, c, transition_function) key
+    cdef int _pmf_s, _pmf_c
+    cdef object _pmf_tf
+    cdef np.ndarray _pmf_cache
 
     def __init__(self, int n_stim, float inverse_temp, float gamma, float stop_criterion, float alpha):
 
@@ -276,24 +324,43 @@ cdef class RewardHypothesis(object):
         self.experience = list()
         self.log_prior = 0
 
+        self._ll_cache = 0
+        self._ll_dirty = False
+
+        self._pmf_s = -1
+        self._pmf_c = -1
+        self._pmf_tf = None
+        self._pmf_cache = None
+
     def update(self, int c, int sp, int r):
         cdef int k = self.cluster_assignments[c]
         cdef RewardCluster cluster = self.clusters[k]
+        if cluster._shared:
+            cluster = cluster.deep_copy()
         cluster.update(sp, r)
         self.clusters[k] = cluster
         self.experience.append((k, sp, r))
+        self._ll_dirty = True
+        self._pmf_tf = None
 
     def deep_copy(self):
         cdef RewardHypothesis _h_copy = RewardHypothesis(self.n_stim, self.inverse_temperature, self.gamma,
                                                          self.iteration_criterion,  self.alpha)
 
-        # deep copy each list, dictionary, cluster, etc.
+        # share the clusters with the copy; they are duplicated lazily on the
+        # first write (most children of an augmentation never touch most of
+        # their clusters)
         cdef int c, k, sp, r
         cdef RewardCluster cluster
+        for cluster in self.clusters.itervalues():
+            cluster._shared = True
+
         _h_copy.cluster_assignments = {c: k for c, k in self.cluster_assignments.iteritems()}
-        _h_copy.clusters = {k: cluster.deep_copy() for k, cluster in self.clusters.iteritems()}
+        _h_copy.clusters = {k: cluster for k, cluster in self.clusters.iteritems()}
         _h_copy.experience = [(k, sp, r) for k, sp, r in self.experience]
         _h_copy.log_prior = get_prior_log_probability(_h_copy.cluster_assignments, _h_copy.alpha)
+        _h_copy._ll_cache = self._ll_cache
+        _h_copy._ll_dirty = self._ll_dirty
 
         return _h_copy
 
@@ -310,6 +377,7 @@ cdef class RewardHypothesis(object):
 
         self.cluster_assignments[c] = k  # note, there's no check built in here
         self.log_prior = get_prior_log_probability(self.cluster_assignments, self.alpha)
+        self._pmf_tf = None
 
     def get_assignments(self):
         return self.cluster_assignments
@@ -319,10 +387,15 @@ cdef class RewardHypothesis(object):
         cdef int k, sp, r
         cdef RewardCluster cluster
 
+        if not self._ll_dirty:
+            return self._ll_cache
+
         for k, sp, r in self.experience:
             cluster = self.clusters[k]
             log_likelihood += log(cluster.get_observation_probability(sp, r))
 
+        self._ll_cache = log_likelihood
+        self._ll_dirty = False
         return log_likelihood
 
     def get_log_posterior(self):
@@ -355,15 +428,27 @@ cdef class RewardHypothesis(object):
 
         return q_values
 
-    def select_abstract_action_pmf(self, int s, int c, double[:,:,::1] transition_function):
+    def select_abstract_action_pmf(self, int s, int c, transition_function):
+        # the agents call this with the same (s, c, transition_function) from
+        # back-to-back entry points within a decision step; reuse the last
+        # answer when the key matches (the cache is dropped on new experience).
+        # hand back a copy so in-place edits by callers cannot poison the cache
+        if self._pmf_tf is transition_function and self._pmf_s == s and self._pmf_c == c:
+            return self._pmf_cache.copy()
+
         cdef np.ndarray[DTYPE_t, ndim=1] q_values = self.get_abstract_action_q_values(s, c, transition_function)
 
         # we need q-values to properly consider multiple options of equivalent optimality, but we can just always
         # pass a very high value for the temperature
         cdef np.ndarray[DTYPE_t, ndim=1] pmf = np.exp(np.array(q_values) * float(self.inverse_temperature))
-        pmf = pmf / np.sum(pmf)
+        pmf *= 1.0 / pmf.sum()
 
-        return pmf
+        self._pmf_s = s
+        self._pmf_c = c
+        self._pmf_tf = transition_function
+        self._pmf_cache = pmf
+
+        return pmf.copy()
 
     def get_reward_function(self, int c):
         cdef int k = self.cluster_assignments[c]
@@ -396,4 +481,30 @@ cdef class RewardHypothesis(object):
 
         for k in range(len(self.clusters)):
             cluster = self.clusters[k]
+            if cluster._shared:
+                cluster = cluster.deep_copy()
+                self.clusters[k] = cluster
             cluster.set_prior(list_goals)
+
+        self._ll_dirty = True
+        self._pmf_tf = None
+
+
+cpdef update_reward_batch(list hypotheses, int c, int sp, int r):
+    """ apply a single reward observation to every hypothesis; one call across
+    the python/cython boundary per observation instead of one per hypothesis """
+    cdef int ii
+    cdef RewardHypothesis h_r
+    for ii in range(len(hypotheses)):
+        h_r = hypotheses[ii]
+        h_r.update(c, sp, r)
+
+
+cpdef update_mapping_batch(list hypotheses, int c, int a, int aa):
+    """ apply a single mapping observation to every hypothesis; one call across
+    the python/cython boundary per observation instead of one per hypothesis """
+    cdef int ii
+    cdef MappingHypothesis h_m
+    for ii in range(len(hypotheses)):
+        h_m = hypotheses[ii]
+        h_m.updating_mapping(c, a, aa)
@@ -9,7 +9,8 @@ def softmax_to_pdf(q_values, inverse_temperature):
 
 
 def sample_cmf(cmf):
-    return int(np.sum(np.random.rand() > cmf))
+    # binary search on the cumulative function with a single uniform draw
+    return int(np.searchsorted(cmf, np.random.random(), side='right'))
 
 
 class SimpleFlat(object):
@@ -1,6 +1,6 @@
 import numpy as np
 import pandas as pd
-from agents import sample_cmf, augment_assignments
+from agents import sample_cmf, augment_assignments, _assignment_to_array
 from rooms_problem import GridWorld
 from cython_library import GoalHypothesis, value_iteration
 from cython_library import R_MappingHypothesis as MappingHypothesis
@@ -10,20 +10,20 @@ function (and possibly a reward function) to the agent for each trial. """
 
 
 def make_q_primitive(q_abstract, mapping):
-    q_primitive = np.zeros(8)
-    n, m = np.shape(mapping)
-    for aa in range(m):
-        for a in range(n):
-            q_primitive[a] += q_abstract[aa] * mapping[a, aa]
-    return q_primitive
+    # single matrix-vector product; slice off the trailing dummy abstract action
+    # if the mapping carries one
+    mapping = np.asarray(mapping, dtype=np.float64)
+    q_abstract = np.asarray(q_abstract, dtype=np.float64)
+    return mapping[:, :len(q_abstract)].dot(q_abstract)
 
 
 def kl_divergence(q, p):
-    d = 0
-    for q_ii, p_ii in zip(q, p):
-        if p_ii > 0:
-            d += p_ii * np.log2(p_ii/q_ii)
-    return d
+    q = np.asarray(q, dtype=np.float64)
+    p = np.asarray(p, dtype=np.float64)
+
+    # single vectorized log2 over the supported entries
+    m = (p > 0) & (q > 0)
+    return float(np.sum(p[m] * np.log2(p[m] / q[m])))
 
 
 class MultiStepAgent(object):
@@ -347,8 +347,6 @@ class FlatAgent(MultiStepAgent):
         h_g = self.goal_hypotheses[0]
         h_m = self.mapping_hypotheses[0]
 
-        assert type(h_g) is GoalHypothesis
-        assert type(h_m) is MappingHypothesis
 
         h_g.add_new_context_assignment(context, context)
         h_m.add_new_context_assignment(context, context)
@@ -358,26 +356,22 @@ class FlatAgent(MultiStepAgent):
     def update_goal_values(self, c, goal, r):
         goal_idx_num = self.task.get_goal_index(goal)
         for h_goal in self.goal_hypotheses:
-            assert type(h_goal) is GoalHypothesis
             h_goal.update(c, goal_idx_num, r)
 
         # update the posterior of the goal hypotheses
         log_belief = np.zeros(len(self.goal_hypotheses))
         for ii, h_goal in enumerate(self.goal_hypotheses):
-            assert type(h_goal) is GoalHypothesis
             log_belief[ii] = h_goal.get_log_posterior()
 
         self.log_belief_goal = log_belief
 
     def update_mapping(self, c, a, aa):
         for h_m in self.mapping_hypotheses:
-            assert type(h_m) is MappingHypothesis
             h_m.update_mapping(c, a, self.task.abstract_action_key[aa])
 
         # update the posterior of the mapping hypothesis
         log_belief = np.zeros(len(self.mapping_hypotheses))
         for ii, h_m in enumerate(self.mapping_hypotheses):
-            assert type(h_m) is MappingHypothesis
             log_belief[ii] = h_m.get_log_posterior()
 
         self.log_belief_map = log_belief
@@ -386,7 +380,6 @@ class FlatAgent(MultiStepAgent):
         # get the value of the goals for the MAP cluster
         ii = np.argmax(self.log_belief_goal)
         h_goal = self.goal_hypotheses[ii]
-        assert type(h_goal) is GoalHypothesis
 
         goal_pmf = h_goal.get_goal_probability(context)
 
@@ -397,7 +390,6 @@ class FlatAgent(MultiStepAgent):
         ii = np.argmax(self.log_belief_map)
 
         h_map = self.mapping_hypotheses[ii]
-        assert type(h_map) is MappingHypothesis
 
         mapping_pmf = np.zeros(self.task.n_primitive_actions, dtype=float)
         for a0 in range(self.task.n_primitive_actions):
@@ -511,14 +503,13 @@ class IndependentClusterAgent(FlatAgent):
         _mapping_log_belief = list()
 
         for h_g in self.goal_hypotheses:
-            assert type(h_g) is GoalHypothesis
 
-            old_assignments = h_g.get_assignments()
+            old_assignments = _assignment_to_array(h_g.get_assignments(), context + 1)
             new_assignments = augment_assignments([old_assignments], context)
 
             # create a list of the new clusters to add
             for assignment in new_assignments:
-                k = assignment[context]
+                k = int(assignment[context])
                 h_r0 = h_g.deep_copy()
                 h_r0.add_new_context_assignment(context, k)
 
@@ -526,13 +517,12 @@ class IndependentClusterAgent(FlatAgent):
                 _goal_log_belief.append(h_r0.get_log_posterior())
 
         for h_m in self.mapping_hypotheses:
-            assert type(h_m) is MappingHypothesis
 
-            old_assignments = h_m.get_assignments()
+            old_assignments = _assignment_to_array(h_m.get_assignments(), context + 1)
             new_assignments = augment_assignments([old_assignments], context)
 
             for assignment in new_assignments:
-                k = assignment[context]
+                k = int(assignment[context])
                 h_m0 = h_m.deep_copy()
                 h_m0.add_new_context_assignment(context, k)
 
@@ -642,14 +632,13 @@ class FlatMapPriorAgent(FlatAgent):
         _mapping_log_belief = list()
 
         for h_g in self.goal_hypotheses:
-            assert type(h_g) is GoalHypothesis
 
-            old_assignments = h_g.get_assignments()
+            old_assignments = _assignment_to_array(h_g.get_assignments(), context + 1)
             new_assignments = augment_assignments([old_assignments], context)
 
             # create a list of the new clusters to add
             for assignment in new_assignments:
-                k = assignment[context]
+                k = int(assignment[context])
                 h_r0 = h_g.deep_copy()
                 h_r0.add_new_context_assignment(context, k)
 
@@ -657,13 +646,12 @@ class FlatMapPriorAgent(FlatAgent):
                 _goal_log_belief.append(h_r0.get_log_posterior())
 
         for h_m in self.mapping_hypotheses:
-            assert type(h_m) is MappingHypothesis
 
-            old_assignments = h_m.get_assignments()
+            old_assignments = _assignment_to_array(h_m.get_assignments(), context + 1)
             new_assignments = augment_assignments([old_assignments], context)
 
             for assignment in new_assignments:
-                k = assignment[context]
+                k = int(assignment[context])
                 h_m0 = h_m.deep_copy()
                 h_m0.add_new_context_assignment(context, k)
 
@@ -703,13 +691,11 @@ class FlatMapPriorAgent(FlatAgent):
 
     def update_mapping(self, c, a, aa):
         for h_m in self.mapping_hypotheses:
-            assert type(h_m) is MappingHypothesis
             h_m.update_mapping(c, a, self.task.abstract_action_key[aa])
 
         # update the posterior of the mapping hypothesis
         log_belief = np.zeros(len(self.mapping_hypotheses))
         for ii, h_m in enumerate(self.mapping_hypotheses):
-            assert type(h_m) is MappingHypothesis
             log_belief[ii] = h_m.get_log_likelihood()
 
         self.log_belief_map = log_belief
@@ -782,14 +768,12 @@ class JointClusteringAgent(MultiStepAgent):
         _mapping_hypotheses = list()
 
         for h_g, h_m in zip(self.goal_hypotheses, self.mapping_hypotheses):
-            assert type(h_g) is GoalHypothesis
-            assert type(h_m) is MappingHypothesis
 
-            old_assignments = h_g.get_assignments()
+            old_assignments = _assignment_to_array(h_g.get_assignments(), context + 1)
             new_assignments = augment_assignments([old_assignments], context)
 
             for assignment in new_assignments:
-                k = assignment[context]
+                k = int(assignment[context])
                 h_g0 = h_g.deep_copy()
                 h_g0.add_new_context_assignment(context, k)
 
@@ -829,7 +813,6 @@ class JointClusteringAgent(MultiStepAgent):
     def update_goal_values(self, c, goal, r):
         goal_idx_num = self.task.get_goal_index(goal)
         for h_goal in self.goal_hypotheses:
-            assert type(h_goal) is GoalHypothesis
             h_goal.update(c, goal_idx_num, r)
 
         # update the belief distribution
@@ -838,7 +821,6 @@ class JointClusteringAgent(MultiStepAgent):
 
     def update_mapping(self, c, a, aa):
         for h_map in self.mapping_hypotheses:
-            assert type(h_map) is MappingHypothesis
             h_map.update_mapping(c, a, self.task.abstract_action_key[aa])
 
         # update the belief distribution
@@ -877,7 +859,6 @@ class JointClusteringAgent(MultiStepAgent):
         # get the value of the goals of the MAP cluster
         ii = np.argmax(self.log_belief)
         h_goal = self.goal_hypotheses[ii]
-        assert type(h_goal) is GoalHypothesis
 
         goal_expectation = h_goal.get_goal_probability(context)
 
@@ -888,7 +869,6 @@ class JointClusteringAgent(MultiStepAgent):
         ii = np.argmax(self.log_belief)
 
         h_map = self.mapping_hypotheses[ii]
-        assert type(h_map) is MappingHypothesis
 
         mapping_expectation = np.zeros(self.task.n_primitive_actions, dtype=float)
         for a0 in range(self.task.n_primitive_actions):